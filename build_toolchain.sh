@@ -1,6 +1,7 @@
 #!/bin/bash
 set -e  # Dừng ngay nếu gặp lỗi
 set -u  # Báo lỗi nếu dùng biến chưa khai báo
+set -o pipefail  # Lỗi ở bất kỳ lệnh nào trong pipe cũng làm dừng script
 
 # ==============================================================================
 # 1. CẤU HÌNH (BẠN CÓ THỂ SỬA Ở ĐÂY)
@@ -11,11 +12,48 @@ set -u  # Báo lỗi nếu dùng biến chưa khai báo
 BINUTILS_VERSION="${BINUTILS_VERSION:-2.42}"
 GCC_VERSION="${GCC_VERSION:-13.2.0}"
 
+# SHA-256 mong đợi của tarball nguồn (tùy chọn). Để trống thì bỏ qua kiểm tra.
+BINUTILS_SHA256="${BINUTILS_SHA256:-}"
+GCC_SHA256="${GCC_SHA256:-}"
+
+# Danh sách mirror GNU (cách nhau bởi dấu cách), thử lần lượt từng cái.
+# Mirror tải thành công gần nhất được ưu tiên thử trước ở lần chạy sau.
+GNU_MIRRORS="${GNU_MIRRORS:-https://ftp.gnu.org/gnu https://ftpmirror.gnu.org}"
+
+# Đường dẫn source (tương đối so với gốc mirror)
+BINUTILS_ARCHIVE="binutils/binutils-$BINUTILS_VERSION.tar.xz"
+GCC_ARCHIVE="gcc/gcc-$GCC_VERSION/gcc-$GCC_VERSION.tar.xz"
+
+# Tên thư mục source sau khi giải nén
+BINUTILS_SRC="binutils-$BINUTILS_VERSION"
+GCC_SRC="gcc-$GCC_VERSION"
+
 # Tương tự với Target
 TARGET="${TARGET:-x86_64-elf}"
 
-# Số luồng CPU để build (Lấy tối đa)
-JOBS=$(nproc)
+# Số luồng CPU để build (mặc định lấy tối đa).
+# nproc chỉ đếm các CPU mà tiến trình được phép chạy (sched affinity),
+# nhưng không biết quota cgroup của container -> khi đó hãy set JOBS.
+JOBS="${JOBS:-$(nproc)}"
+
+# Cờ configure cố định (target/prefix được thêm lúc gọi configure)
+BINUTILS_CONFIGURE_FLAGS=(
+    --with-sysroot
+    --disable-nls
+    --disable-werror
+)
+
+# LƯU Ý: Đây là cấu hình cho OS Dev (Freestanding, no libc)
+GCC_CONFIGURE_FLAGS=(
+    --disable-nls
+    --enable-languages=c,c++
+    --without-headers
+    --disable-shared
+    --disable-multilib
+    --disable-threads
+    --disable-libgomp
+    --disable-libssp
+)
 
 # Tên file kết quả
 OUTPUT_PACKAGE="${TARGET}-gcc${GCC_VERSION}-binutils${BINUTILS_VERSION}.tar.gz"
@@ -25,6 +63,9 @@ WORK_DIR="$(pwd)/toolchain_build"
 SOURCES_DIR="$WORK_DIR/sources"
 BUILD_DIR="$WORK_DIR/build"
 INSTALL_DIR="$WORK_DIR/install" # Thư mục cài đặt tạm thời
+BINUTILS_BUILD_DIR="$BUILD_DIR/binutils"
+GCC_BUILD_DIR="$BUILD_DIR/gcc"
+MIRROR_CACHE="$SOURCES_DIR/.preferred_mirror"
 
 # ==============================================================================
 # 2. HÀM HỖ TRỢ (LOGGING & DOWNLOAD)
@@ -33,56 +74,213 @@ info()  { printf "\033[0;32m[INFO]\033[0m %s\n" "$*"; }
 warn()  { printf "\033[1;33m[WARN]\033[0m %s\n" "$*"; }
 error() { printf "\033[0;31m[ERROR]\033[0m %s\n" "$*" >&2; exit 1; }
 
+# Ghi file "<archive>.sha256" chứa "mtime size digest" để lần chạy sau
+# khỏi phải băm lại archive nếu file không đổi.
+write_checksum_sidecar() {
+    local file_name=$1
+    local digest=$2
+
+    printf "%s %s\n" "$(stat -c '%Y %s' "$file_name")" "$digest" > "$file_name.sha256"
+}
+
+# Kiểm tra SHA-256 của archive đã có sẵn. Nếu sidecar khớp mtime/size
+# thì tin luôn digest đã lưu, chỉ băm lại khi file đã bị thay đổi.
+verify_cached_source() {
+    local file_name=$1
+    local sha256=$2
+    local stamp cached actual
+
+    if [ -f "$file_name.sha256" ]; then
+        stamp=$(stat -c '%Y %s' "$file_name")
+        read -r cached < "$file_name.sha256" || true
+        if [ "$cached" = "$stamp $sha256" ]; then
+            return 0
+        fi
+        rm -f "$file_name.sha256"
+    fi
+
+    actual=$(sha256sum "$file_name" | cut -d' ' -f1)
+    [ "$actual" = "$sha256" ] || error "Checksum mismatch for $file_name (got $actual)"
+    write_checksum_sidecar "$file_name" "$actual"
+}
+
+# In danh sách mirror, mirror thành công lần trước (nếu còn trong
+# GNU_MIRRORS) đứng đầu để khỏi chờ timeout ở mirror chết mỗi lần chạy.
+ordered_mirrors() {
+    local preferred="" mirror
+
+    if [ -f "$MIRROR_CACHE" ]; then
+        read -r preferred < "$MIRROR_CACHE" || true
+    fi
+    for mirror in $GNU_MIRRORS; do
+        if [ "$mirror" = "$preferred" ]; then
+            echo "$mirror"
+        fi
+    done
+    for mirror in $GNU_MIRRORS; do
+        if [ "$mirror" != "$preferred" ]; then
+            echo "$mirror"
+        fi
+    done
+}
+
+download_source() {
+    local archive=$1
+    local file_name=$(basename "$archive")
+    local sha256=${2:-}
+    local actual mirror
+
+    cd "$SOURCES_DIR"
+
+    if [ -f "$file_name" ]; then
+        info "File $file_name already exists. Skipping download."
+        if [ -n "$sha256" ]; then
+            verify_cached_source "$file_name" "$sha256"
+        fi
+        return
+    fi
+
+    for mirror in $(ordered_mirrors); do
+        info "Downloading $file_name from $mirror..."
+        # Băm ngay trên luồng tải về (một lượt duy nhất), ghi vào file .part
+        # rồi mới đổi tên để lần chạy sau không nhận nhầm file tải dở.
+        if ! actual=$(wget -q --show-progress --timeout=30 --tries=2 -O - "$mirror/$archive" \
+                | tee "$file_name.part" | sha256sum | cut -d' ' -f1); then
+            warn "Failed to download from $mirror"
+            continue
+        fi
+        if [ -n "$sha256" ] && [ "$actual" != "$sha256" ]; then
+            warn "Checksum mismatch for $file_name from $mirror (got $actual)"
+            continue
+        fi
+        mv "$file_name.part" "$file_name"
+        write_checksum_sidecar "$file_name" "$actual"
+        echo "$mirror" > "$MIRROR_CACHE"
+        return
+    done
+
+    rm -f "$file_name.part"
+    error "Failed to download $file_name from all mirrors"
+}
+
+# Giải nén bằng bộ giải nén đa luồng nếu có (xz -T0 / pigz),
+# nếu không thì để tar tự chọn chương trình mặc định.
+# --no-same-owner: source tree chỉ là tạm, không cần chown từng file
+# (khi chạy bằng root, tar mặc định sẽ khôi phục owner cho mọi file).
+extract_archive() {
+    local file_name=$1
+
+    case "$file_name" in
+        *.tar.xz)
+            if command -v xz >/dev/null 2>&1; then
+                tar --no-same-owner --use-compress-program="xz -T0" -xf "$file_name"
+                return
+            fi
+            ;;
+        *.tar.gz|*.tgz)
+            if command -v pigz >/dev/null 2>&1; then
+                tar --no-same-owner --use-compress-program=pigz -xf "$file_name"
+                return
+            fi
+            ;;
+    esac
+    tar --no-same-owner -xf "$file_name"
+}
+
+# Source đã giải nén xong khi có file đánh dấu ".extracted.ok" khớp với
+# mtime của archive (nếu archive đã bị xóa thì tin vào file đánh dấu).
+# Thư mục không có file đánh dấu là bản giải nén dở từ lần chạy lỗi trước.
+source_extracted() {
+    local file_name=$1
+    local dir_name=$2
+    local stamp
+
+    [ -f "$dir_name/.extracted.ok" ] || return 1
+    [ -f "$file_name" ] || return 0
+    read -r stamp < "$dir_name/.extracted.ok" || return 1
+    [ "$stamp" = "$(stat -c '%Y' "$file_name")" ]
+}
+
 download_and_extract() {
-    local url=$1
-    local file_name=$(basename "$url")
+    local archive=$1
+    local file_name=$(basename "$archive")
     local dir_name=$2
+    local sha256=${3:-}
 
-    mkdir -p "$SOURCES_DIR"
     cd "$SOURCES_DIR"
 
-    if [ ! -d "$dir_name" ]; then
-        if [ ! -f "$file_name" ]; then
-            info "Downloading $file_name..."
-            wget -q --show-progress "$url"
-        else
-            info "File $file_name already exists. Skipping download."
+    if ! source_extracted "$file_name" "$dir_name"; then
+        download_source "$archive" "$sha256"
+
+        if [ -d "$dir_name" ]; then
+            warn "Removing incomplete $dir_name from a previous run..."
+            rm -rf "$dir_name"
         fi
-        
         info "Extracting $file_name..."
-        tar -xf "$file_name"
+        extract_archive "$file_name"
+        stat -c '%Y' "$file_name" > "$dir_name/.extracted.ok"
     else
         info "Source $dir_name already extracted."
     fi
 }
 
+# Giải nén GCC và tải prerequisites (GMP, MPFR, MPC) vào trong source tree.
+# Chỉ đụng tới $SOURCES_DIR nên có thể chạy nền song song với build Binutils.
+prepare_gcc_source() {
+    download_and_extract \
+        "$GCC_ARCHIVE" \
+        "$GCC_SRC" \
+        "$GCC_SHA256"
+
+    if [ ! -d "$SOURCES_DIR/$GCC_SRC/gmp" ]; then
+        info "Downloading GCC prerequisites (gmp, mpfr, mpc)..."
+        cd "$SOURCES_DIR/$GCC_SRC"
+        ./contrib/download_prerequisites
+    fi
+}
+
 # ==============================================================================
 # 3. QUÁ TRÌNH BUILD
 # ==============================================================================
 
-# Chuẩn bị thư mục
-mkdir -p "$BUILD_DIR" "$INSTALL_DIR"
+# Chuẩn bị toàn bộ cây thư mục một lần (các hàm phía dưới coi như đã có sẵn)
+mkdir -p "$SOURCES_DIR" "$BINUTILS_BUILD_DIR" "$GCC_BUILD_DIR" "$INSTALL_DIR"
 # Thêm bin vào PATH để GCC tìm thấy Binutils vừa build
 export PATH="$INSTALL_DIR/bin:$PATH"
 
+# Dùng ccache (nếu có) cho trình biên dịch host để các lần build lại nhanh hơn.
+# Không ghi đè nếu người dùng đã tự chọn CC/CXX.
+if command -v ccache >/dev/null 2>&1 && [ -z "${CC:-}" ] && [ -z "${CXX:-}" ]; then
+    info "Using ccache for host compiler"
+    export CC="ccache gcc"
+    export CXX="ccache g++"
+fi
+
+# Không để job nền chạy tiếp nếu script dừng giữa chừng
+trap 'kill $(jobs -p) 2>/dev/null || true' EXIT
+
+# Chuẩn bị source GCC (tải, giải nén, prerequisites) chạy nền trong lúc
+# Binutils được tải và build, thay vì chờ Binutils xong mới bắt đầu.
+info "Preparing GCC $GCC_VERSION sources in background..."
+prepare_gcc_source &
+GCC_PREPARE_PID=$!
+
 # --- BƯỚC 1: BINUTILS ---
 info "=== STEP 1/3: BUILD BINUTILS $BINUTILS_VERSION ==="
 
 download_and_extract \
-    "https://ftp.gnu.org/gnu/binutils/binutils-$BINUTILS_VERSION.tar.xz" \
-    "binutils-$BINUTILS_VERSION"
+    "$BINUTILS_ARCHIVE" \
+    "$BINUTILS_SRC" \
+    "$BINUTILS_SHA256"
 
-mkdir -p "$BUILD_DIR/binutils"
-cd "$BUILD_DIR/binutils"
+cd "$BINUTILS_BUILD_DIR"
 
 if [ ! -f Makefile ]; then
     info "Configuring Binutils..."
-    "$SOURCES_DIR/binutils-$BINUTILS_VERSION/configure" \
+    "$SOURCES_DIR/$BINUTILS_SRC/configure" \
         --target="$TARGET" \
         --prefix="$INSTALL_DIR" \
-        --with-sysroot \
-        --disable-nls \
-        --disable-werror
+        "${BINUTILS_CONFIGURE_FLAGS[@]}"
 fi
 
 info "Compiling Binutils..."
@@ -93,34 +291,16 @@ info "Binutils installed to $INSTALL_DIR"
 # --- BƯỚC 2: GCC ---
 info "=== STEP 2/3: BUILD GCC $GCC_VERSION ==="
 
-download_and_extract \
-    "https://ftp.gnu.org/gnu/gcc/gcc-$GCC_VERSION/gcc-$GCC_VERSION.tar.xz" \
-    "gcc-$GCC_VERSION"
-
-# Tự động tải prerequisites (GMP, MPFR, MPC) vào trong source tree của GCC
-if [ ! -d "$SOURCES_DIR/gcc-$GCC_VERSION/gmp" ]; then
-    info "Downloading GCC prerequisites (gmp, mpfr, mpc)..."
-    cd "$SOURCES_DIR/gcc-$GCC_VERSION"
-    ./contrib/download_prerequisites
-fi
+wait "$GCC_PREPARE_PID" || error "Failed to prepare GCC $GCC_VERSION sources"
 
-mkdir -p "$BUILD_DIR/gcc"
-cd "$BUILD_DIR/gcc"
+cd "$GCC_BUILD_DIR"
 
 if [ ! -f Makefile ]; then
     info "Configuring GCC..."
-    # LƯU Ý: Đây là cấu hình cho OS Dev (Freestanding, no libc)
-    "$SOURCES_DIR/gcc-$GCC_VERSION/configure" \
+    "$SOURCES_DIR/$GCC_SRC/configure" \
         --target="$TARGET" \
         --prefix="$INSTALL_DIR" \
-        --disable-nls \
-        --enable-languages=c,c++ \
-        --without-headers \
-        --disable-shared \
-        --disable-multilib \
-        --disable-threads \
-        --disable-libgomp \
-        --disable-libssp
+        "${GCC_CONFIGURE_FLAGS[@]}"
 fi
 
 info "Compiling GCC (This may take a while)..."
@@ -137,9 +317,23 @@ info "=== STEP 3/3: PACKAGING ==="
 cd "$WORK_DIR"
 info "Creating archive: $OUTPUT_PACKAGE"
 
-# Nén nội dung thư mục install (nhưng không lấy folder cha install/)
-tar -czf "$OUTPUT_PACKAGE" -C "$INSTALL_DIR" .
+# Nén bằng pigz (gzip đa luồng) nếu có, file kết quả vẫn là .tar.gz.
+if command -v pigz >/dev/null 2>&1; then
+    COMPRESS_CMD=(pigz -p "$JOBS")
+else
+    COMPRESS_CMD=(gzip)
+fi
+
+# Nén nội dung thư mục install (nhưng không lấy folder cha install/).
+# SHA-256 được tính ngay trên luồng nén, không phải đọc lại file lần nữa.
+PACKAGE_SHA256=$(tar -cf - -C "$INSTALL_DIR" . \
+    | "${COMPRESS_CMD[@]}" \
+    | tee "$OUTPUT_PACKAGE" \
+    | sha256sum | cut -d' ' -f1)
+# Cùng định dạng với sha256sum để kiểm tra lại bằng "sha256sum -c"
+printf "%s  %s\n" "$PACKAGE_SHA256" "$OUTPUT_PACKAGE" > "$OUTPUT_PACKAGE.sha256"
 
 info "SUCCESS!"
 info "Toolchain Package: $WORK_DIR/$OUTPUT_PACKAGE"
+info "SHA-256: $PACKAGE_SHA256"
 info "Size: $(du -h "$OUTPUT_PACKAGE" | cut -f1)"
\ No newline at end of file